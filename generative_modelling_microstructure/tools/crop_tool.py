@@ -20,16 +20,25 @@ import os
 import cv2
 import numpy as np
 import tkinter as tk
-from PIL import Image, ImageTk
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Widest preview shown in the window; larger images are downsampled for display
+MAX_PREVIEW_W = 1200
+
+# BGR thresholds for the green scale bar: bright green that clearly
+# dominates both red and blue
+_GREEN_MIN = 80
+_GREEN_MARGIN = 30
 
 
 def detect_scale_bar(image_bgr):
     """Detect green scale bar in the image. Returns pixel length or 0."""
-    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
-    lower_green = np.array([40, 100, 100])
-    upper_green = np.array([80, 255, 255])
-    mask = cv2.inRange(hsv, lower_green, upper_green)
+    b, g, r = cv2.split(image_bgr)
+    # cv2.subtract saturates at 0, so uint8 differences need no upcast
+    mask = ((g > _GREEN_MIN)
+            & (cv2.subtract(g, r) > _GREEN_MARGIN)
+            & (cv2.subtract(g, b) > _GREEN_MARGIN)).astype(np.uint8) * 255
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours:
@@ -40,43 +49,95 @@ def detect_scale_bar(image_bgr):
     return w
 
 
-def interactive_crop(image_rgb, crop_size_px, target_pixel_size, output_dir):
+def _write_bytes(path, data):
+    """Write already-encoded image bytes to disk."""
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _report_write(save_path, future):
+    """Report whether a background patch write reached the disk."""
+    if future.exception() is not None:
+        print(f"Error saving {save_path}: {future.exception()}")
+    else:
+        print(f"Saved: {save_path}")
+
+
+def interactive_crop(image_bgr, crop_size_px, target_pixel_size, output_dir):
     """Interactive Tkinter GUI for selecting patches and saving them."""
 
-    patches_saved = 0
-    img_pil = Image.fromarray(image_rgb)
+    # Background writes of the saved patches, in click order
+    writes = []
+    # Show a downsampled preview of large images so Tk redraws stay fast;
+    # clicks are mapped back to full resolution through `scale`
+    scale = min(1.0, MAX_PREVIEW_W / image_bgr.shape[1])
+    if scale < 1.0:
+        preview = cv2.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        preview = image_bgr
+    preview_crop_px = crop_size_px * scale
+
+    # Disk writes run off the Tk thread so clicks return immediately
+    io_exec = ThreadPoolExecutor(max_workers=2)
+    # Every patch has the same output size, so resize into one reused buffer
+    resize_dst = np.empty((target_pixel_size, target_pixel_size, image_bgr.shape[2]), dtype=image_bgr.dtype)
 
     root = tk.Tk()
     root.title("Crop Tool — Click to Save Patches. Press Q to Quit")
 
-    img_tk = ImageTk.PhotoImage(img_pil, master=root)
-    canvas = tk.Canvas(root, width=img_pil.width, height=img_pil.height)
+    # Patches are cropped and saved in BGR; only the display needs RGB.
+    # Hand Tk a raw PPM so it decodes the preview in C, bypassing PIL.
+    preview_rgb = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
+    height, width = preview_rgb.shape[:2]
+    ppm = f"P6\n{width} {height}\n255\n".encode() + preview_rgb.tobytes()
+    img_tk = tk.PhotoImage(data=ppm, format="PPM", master=root)
+    canvas = tk.Canvas(root, width=width, height=height)
     canvas.pack()
     canvas.create_image(0, 0, anchor="nw", image=img_tk)
 
-    rect = canvas.create_rectangle(0, 0, crop_size_px, crop_size_px, outline="red", width=2)
+    rect = canvas.create_rectangle(0, 0, preview_crop_px, preview_crop_px, outline="red", width=2)
+
+    # Mouse moves only record the position; the box is redrawn at most
+    # every 16 ms (~60 Hz) so fast mice don't flood Tk with redraws
+    last_xy = (0, 0)
+    after_id = None
+
+    def flush():
+        nonlocal after_id
+        after_id = None
+        x, y = last_xy
+        canvas.coords(rect, x, y, x + preview_crop_px, y + preview_crop_px)
 
     def on_motion(event):
-        x, y = event.x, event.y
-        canvas.coords(rect, x, y, x + crop_size_px, y + crop_size_px)
+        nonlocal last_xy, after_id
+        last_xy = (event.x, event.y)
+        if after_id is None:
+            after_id = root.after(16, flush)
 
     def on_click(event):
-        nonlocal patches_saved
-        x, y = int(event.x), int(event.y)
-        y_end = min(y + crop_size_px, image_rgb.shape[0])
-        x_end = min(x + crop_size_px, image_rgb.shape[1])
-        crop = image_rgb[y:y_end, x:x_end, :]
-        crop_resized = cv2.resize(crop, (target_pixel_size, target_pixel_size), interpolation=cv2.INTER_AREA)
-        filename = f"patch_{patches_saved+1:03d}_{datetime.now().strftime('%H%M%S')}.png"
+        x, y = int(event.x / scale), int(event.y / scale)
+        y_end = min(y + crop_size_px, image_bgr.shape[0])
+        x_end = min(x + crop_size_px, image_bgr.shape[1])
+        crop = image_bgr[y:y_end, x:x_end, :]
+        if crop.shape[:2] == (target_pixel_size, target_pixel_size):
+            # Crop is already the target size; encode it as-is
+            patch = crop
+        else:
+            cv2.resize(crop, (target_pixel_size, target_pixel_size), dst=resize_dst, interpolation=cv2.INTER_AREA)
+            patch = resize_dst
+        filename = f"patch_{len(writes)+1:03d}_{datetime.now().strftime('%H%M%S')}.png"
         save_path = os.path.join(output_dir, filename)
-        cv2.imwrite(save_path, cv2.cvtColor(crop_resized, cv2.COLOR_RGB2BGR))
-        patches_saved += 1
-        print(f"Saved: {save_path}")
+        ok, encoded = cv2.imencode(".png", patch, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        if not ok:
+            print(f"Could not encode patch: {save_path}")
+            return
+        future = io_exec.submit(_write_bytes, save_path, encoded.tobytes())
+        future.add_done_callback(lambda f: _report_write(save_path, f))
+        writes.append(future)
 
     def on_key(event):
         key = event.keysym.lower()
         if key == 'q':
-            print(f"Total patches saved: {patches_saved}")
             root.destroy()
 
     canvas.bind("<Motion>", on_motion)
@@ -88,6 +149,10 @@ def interactive_crop(image_rgb, crop_size_px, target_pixel_size, output_dir):
     print(" • Left-click to save a patch.")
     print(" • Press 'q' or close window to exit.")
     root.mainloop()
+    # Make sure every queued patch is on disk before returning
+    io_exec.shutdown(wait=True)
+    patches_saved = sum(future.exception() is None for future in writes)
+    print(f"Total patches saved: {patches_saved}")
 
 
 def main():
@@ -105,8 +170,6 @@ def main():
     if image is None:
         raise ValueError(f"Could not read image: {image_path}")
 
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
     pixel_length_of_bar = detect_scale_bar(image)
     if pixel_length_of_bar <= 0:
         print("Warning: No green scale bar detected. Using default 1 px/µm.")
@@ -118,7 +181,7 @@ def main():
     crop_size_px = int(target_crop_um * pixels_per_um)
     print(f"Crop box size: {crop_size_px}×{crop_size_px} pixels")
 
-    interactive_crop(image_rgb, crop_size_px, target_pixel_size, output_dir)
+    interactive_crop(image, crop_size_px, target_pixel_size, output_dir)
 
 
 if __name__ == "__main__":
@@ -11,9 +11,166 @@ when the script is run.
 import cv2
 import numpy as np
 import os
-import glob
 import sys
-from skimage.exposure import match_histograms
+import functools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Largest number of images handed to a worker process per task
+CHUNK_SIZE = 32
+
+# Background write threads per worker, and how many matched images may
+# wait for them before matching pauses (each holds a full-size image)
+WRITE_WORKERS = 2
+MAX_PENDING_WRITES = 2 * WRITE_WORKERS
+
+# zlib level 1: much faster PNG writes for a slightly larger file.
+# Only passed for .png outputs; other encoders warn about the unknown key.
+PNG_WRITE_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+# The reference CDF is estimated from every REF_STRIDE-th pixel along each
+# axis, as long as that still leaves at least REF_MIN_SAMPLES pixels
+REF_STRIDE = 4
+REF_MIN_SAMPLES = 10_000
+
+# Reference CDF, handed to each worker process once by _init
+_ref_cdf = None
+
+
+def _compute_cdf(img):
+    """Returns the normalized cumulative histogram of a uint8 image."""
+    # calcHist returns float32 counts; accumulate in float64 so that the
+    # CDF stays exact for large images
+    hist = cv2.calcHist([img], [0], None, [256], [0, 256]).ravel()
+    cdf = np.cumsum(hist, dtype=np.float64)
+    cdf /= cdf[-1]
+    return cdf
+
+
+def build_match_lut(img_src, ref_cdf):
+    """
+    Builds a 256-entry uint8 lookup table that maps the grey levels of
+    img_src onto the reference, such that their histograms match.
+    """
+    src_cdf = _compute_cdf(img_src)
+    return np.searchsorted(ref_cdf, src_cdf).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_ref(path, mtime):
+    """
+    Loads a reference image and returns its CDF. Cached on (path, mtime)
+    so that repeated process_images calls with the same template skip the
+    work, while an edited file is picked up again. Only the 256-entry CDF
+    is kept; the image itself is released as soon as this returns.
+    """
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        # This handles the case where the file exists but is not a valid image
+        raise IOError(f"File {path} is not a valid image or is corrupt.")
+    sample = img[::REF_STRIDE, ::REF_STRIDE]
+    if sample.size < REF_MIN_SAMPLES:
+        sample = img
+    return _compute_cdf(sample)
+
+
+def _init(ref_cdf):
+    """
+    Worker initializer: caches the reference CDF once per process
+    so it does not have to be pickled along with every task.
+    """
+    global _ref_cdf
+    _ref_cdf = ref_cdf
+    # One process already runs per core; keep OpenCV's own thread pool
+    # from oversubscribing them inside cv2.LUT / imread / imwrite.
+    cv2.setNumThreads(1)
+
+
+def _read_images(img_paths, images):
+    """
+    Reader thread: decodes the images of a chunk ahead of the matching
+    loop and puts (path, image) on the queue, ending with (None, None).
+    """
+    try:
+        for img_path in img_paths:
+            images.put((img_path, cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)))
+    finally:
+        images.put((None, None))
+
+
+def _write_failed(img_path, future):
+    """
+    Reports a background write that raised or that cv2.imwrite refused
+    (it returns False instead of raising). Returns True on failure.
+    """
+    if future.exception() is not None:
+        print(f"Error processing {img_path}: {future.exception()}")
+        return True
+    if not future.result():
+        print(f"Error processing {img_path}: could not write the output image.")
+        return True
+    return False
+
+
+def _match_chunk(args):
+    """
+    Matches the histograms of a chunk of images to the cached reference
+    and saves them in output_dir. Reads are prefetched by a reader thread
+    and writes go to a small thread pool, so decoding and PNG encoding
+    both overlap with matching. Returns the number of images that failed.
+    """
+    img_paths, output_dir = args
+    images = queue.Queue(maxsize=4)
+    threading.Thread(target=_read_images, args=(img_paths, images), daemon=True).start()
+
+    failed = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as writer:
+        while True:
+            # Take the next image decoded by the reader thread
+            img_path, img_to_process = images.get()
+            if img_path is None:
+                break
+
+            try:
+                if img_to_process is None:
+                    print(f"Warning: Could not read {img_path}, skipping.")
+                    failed += 1
+                    continue
+                
+                # Match the histogram to the reference. The decoded image is
+                # not needed afterwards, so remap it in place rather than
+                # allocating a second buffer for every image.
+                lut = build_match_lut(img_to_process, _ref_cdf)
+                img_matched = cv2.LUT(img_to_process, lut, dst=img_to_process)
+                
+                # Get the original filename
+                filename = os.path.basename(img_path)
+                output_path = os.path.join(output_dir, filename)
+                
+                # Save the processed image in the background
+                if os.path.splitext(output_path)[1].lower() == ".png":
+                    params = PNG_WRITE_PARAMS
+                else:
+                    params = []
+                # Bound the backlog: wait for the oldest write before
+                # queueing more full-size images
+                while len(pending) >= MAX_PENDING_WRITES:
+                    failed += _write_failed(*pending.popleft())
+                future = writer.submit(cv2.imwrite, output_path, img_matched, params)
+                pending.append((img_path, future))
+                
+            except Exception as e:
+                print(f"Error processing {img_path}: {e}")
+                failed += 1
+
+    # Leaving the with-block waited for the remaining writes
+    for img_path, future in pending:
+        failed += _write_failed(img_path, future)
+    return failed
+
 
 def process_images(reference_path, input_dir, output_dir):
     """
@@ -24,10 +181,8 @@ def process_images(reference_path, input_dir, output_dir):
     # --- 1. Load Reference Image ---
     print(f"\nLoading reference image from: {reference_path}")
     try:
-        img_reference = cv2.imread(reference_path, cv2.IMREAD_GRAYSCALE)
-        if img_reference is None:
-            # This handles the case where the file exists but is not a valid image
-            raise IOError(f"File {reference_path} is not a valid image or is corrupt.")
+        # The reference is fixed, so its CDF only has to be computed once
+        ref_cdf = _load_ref(reference_path, os.path.getmtime(reference_path))
     except Exception as e:
         print(f"--- FATAL ERROR ---")
         print(f"Could not load reference image. Check path and file integrity.")
@@ -47,10 +202,17 @@ def process_images(reference_path, input_dir, output_dir):
 
     # --- 3. Find Images to Process ---
     # Find all common image types, not just .png
-    supported_extensions = ["*.png", "*.jpg", "*.jpeg", "*.bmp", "*.tif", "*.tiff"]
-    image_paths = []
-    for ext in supported_extensions:
-        image_paths.extend(glob.glob(os.path.join(input_dir, ext)))
+    # A single directory scan, filtering by extension in Python
+    supported_extensions = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
+    try:
+        image_paths = [entry.path for entry in os.scandir(input_dir)
+                       if entry.is_file()
+                       and os.path.splitext(entry.name)[1].lower() in supported_extensions]
+    except OSError as e:
+        print(f"--- FATAL ERROR ---")
+        print(f"Could not read input directory: {input_dir}")
+        print(f"Details: {e}")
+        sys.exit(1)
 
     if not image_paths:
         print(f"--- WARNING ---")
@@ -60,30 +222,24 @@ def process_images(reference_path, input_dir, output_dir):
     print(f"Found {len(image_paths)} images. Processing...")
 
     # --- 4. Process and Save Images ---
-    for img_path in image_paths:
-        try:
-            # Read the image to be processed
-            img_to_process = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-            
-            if img_to_process is None:
-                print(f"Warning: Could not read {img_path}, skipping.")
-                continue
-            
-            # Match the histogram to the reference
-            img_matched = match_histograms(img_to_process, img_reference)
-            
-            # Get the original filename
-            filename = os.path.basename(img_path)
-            output_path = os.path.join(output_dir, filename)
-            
-            # Save the processed image
-            # Note: matched image is float, convert back to uint8
-            cv2.imwrite(output_path, img_matched.astype(np.uint8))
-            
-        except Exception as e:
-            print(f"Error processing {img_path}: {e}")
+    # Every image is independent, so spread them across all cores.
+    # Workers receive the 256-entry reference CDF once, in _init.
+    # Large chunks keep per-task dispatch overhead low, but small folders
+    # are split finer so that every worker still gets a share.
+    n_workers = os.cpu_count() or 1
+    chunk_size = max(1, min(CHUNK_SIZE, -(-len(image_paths) // n_workers)))
+    args_list = [(image_paths[i:i + chunk_size], output_dir)
+                 for i in range(0, len(image_paths), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init,
+                             initargs=(ref_cdf,)) as ex:
+        failed = sum(ex.map(_match_chunk, args_list))
             
-    print("\nDone! All images have been matched and saved.")
+    if failed:
+        print(f"\n--- WARNING ---")
+        print(f"{failed} of {len(image_paths)} images could not be processed (see errors above).")
+    else:
+        print("\nDone! All images have been matched and saved.")
     print(f"Your processed dataset is in: {output_dir}")
 
 